@@ -3,8 +3,15 @@ from dash import html, dcc, Input, Output, State
 import dash_bootstrap_components as dbc
 from dash import dash_table
 import utils
+import tracing
 from requests.models import Response
 from dash import callback_context
+import json
+import math
+import threading
+from collections import OrderedDict
+import time
+from flask import Response as FlaskResponse, g, jsonify, request, stream_with_context
 
 
 ############################################# LAYOUT DEFINITION #############################################
@@ -49,6 +56,12 @@ def get_body():
                 type="number",
                 style={"marginBottom": "12px"},
             ),
+            dbc.Checkbox(
+                id="checkbox-uncertainty",
+                label="Show uncertainty bands",
+                value=False,
+                style={"marginBottom": "12px"},
+            ),
             dbc.Button("Compute estimated dimensions", id="button-compute"),
             html.Div(id="placeholder-algoResults"),
             html.Hr(),
@@ -93,6 +106,53 @@ app.layout = get_body()
 
 ############################################# HELPER FUNCTIONS #############################################
 
+# Identical (callback, inputs) pairs received within this window (in seconds) are answered from the previous result
+DEDUPE_WINDOW_S = 2.0
+# ordered from the oldest to the most recent result, so expired entries are always at the front
+_recent_results = OrderedDict()
+_recent_results_lock = threading.Lock()
+
+
+def dedupe(key, func, *args):
+    """
+    Calls `func(*args)` unless an identical call, identified by `key`, was answered less than `DEDUPE_WINDOW_S` seconds ago,
+    in which case the previous result is returned instead of doing the work again.
+
+    Only successful results, i.e. Dash components, are kept. Strings are warnings or error messages (failed database call,
+    401/403/5xx responses, ...) that the user must be able to retry right away.
+
+    The cache is shared by all sessions: if the result depends on who is asking (e.g. a database call sent with the user's
+    credentials), the key must include the identity of the user, otherwise one user's result is served to another.
+
+    Args:
+        key (tuple): Hashable identifier of the call, typically the callback name followed by the values it depends on.
+        func (callable): The function computing the result.
+        *args: Positional arguments passed to `func`.
+
+    Returns:
+        object: The result of `func(*args)`, either freshly computed or reused from the dedupe window.
+    """
+    now = time.monotonic()
+    with _recent_results_lock:
+        cached = _recent_results.get(key)
+        if cached is not None and now - cached[0] < DEDUPE_WINDOW_S:
+            return cached[1]
+
+    result = func(*args)
+    if isinstance(result, str):
+        return result
+
+    # timestamp the result when it is stored, not when the call started: a slow call finishing after a faster one
+    # must land behind it to keep the oldest-first order, and must not be stored already expired
+    now = time.monotonic()
+    with _recent_results_lock:
+        # drop expired entries so the cache does not grow with every distinct input
+        while _recent_results and now - next(iter(_recent_results.values()))[0] >= DEDUPE_WINDOW_S:
+            _recent_results.popitem(last=False)
+        _recent_results[key] = (now, result)
+        _recent_results.move_to_end(key)
+    return result
+
 
 def handleDBresponse(response):
     """
@@ -176,6 +236,35 @@ def handleDBresponse(response):
     return "Unexpected response format"
 
 
+def lookupPart(ref):
+    """
+    Sends a request to the database to retrieve the information on a part.
+
+    Args:
+        ref (str): The reference of the part.
+
+    Returns:
+        object: The HTTP response object returned by the database, or the Exception raised while sending the request.
+    """
+    with tracing.span("searchDB.upstream", reference=ref):
+        # carry the trace id to the database so its logs can be matched with ours
+        headers = tracing.inject({})
+        try:
+            # normally you would interact with an API endpoint here, but for ease of demonstration we fake a successful response
+            # the results will therefore be the same regardless of the input
+            """
+            response = requests.post(
+                "http://website.com/api/DBsearch", json={"reference": ref}, headers=headers
+            )
+            """
+            response = Response()
+            response.status_code = 200
+            response._content = b'{"material": "Steel", "weight": "4"}'
+        except Exception as e:
+            response = e
+        return response
+
+
 ############################################# CALLBACK FUNCTIONS #############################################
 
 
@@ -190,7 +279,7 @@ def searchDB(clicks, ref):
     Returns:
         str or dash.html.Div: If `clicks` is `None` or zero, returns an empty string. 
                               If no reference is provided, returns a warning message.
-                              Otherwise, it simulates a database request and returns the response handled by `handleDBresponse()`.
+                              Otherwise, it sends a request with `lookupPart()` and returns the response handled by `handleDBresponse()`.
     """
     if clicks is None or clicks == 0:
         return ""
@@ -200,24 +289,13 @@ def searchDB(clicks, ref):
             return r"/!\ Please provide an input before launching the search"
         else:
             # send a request to a database
-            try:
-                # normally you would interact with an API endpoint here, but for ease of demonstration we fake a successful response
-                # the results will therefore be the same regardless of the input
-                """
-                response = requests.post(
-                    "http://website.com/api/DBsearch", json={"reference": ref}
-                )
-                """
-                response = Response()
-                response.status_code = 200
-                response._content = b'{"material": "Steel", "weight": "4"}'
-            except Exception as e:
-                response = e
+            response = lookupPart(ref)
             # handle the response or error in the handleDBresponse function
-            return handleDBresponse(response)
+            with tracing.span("handleDBresponse"):
+                return handleDBresponse(response)
 
 
-def compute(n_clicks, weight, material):
+def compute(n_clicks, weight, material, uncertainty=False):
     """
     Computes the dimensions of a material based on user input when the button is clicked.
     
@@ -225,12 +303,14 @@ def compute(n_clicks, weight, material):
         n_clicks (int): Number of times the compute button is clicked.
         weight (float): The weight of the material provided by the user.
         material (str): The type of material provided by the user.
+        uncertainty (bool): Whether to also display the percentile bands computed by `utils.compute_dimensions_uncertainty()`.
 
     Returns:
         str or dash.html.Div: If `n_clicks` is `None` or zero, returns an empty string.
                               If weight or material is missing, returns a warning message.
                               Otherwise, computes the dimensions using `utils.compute_dimensions()` 
-                              and returns the result in a Dash `html.Div` component.
+                              and returns the result in a Dash `html.Div` component, followed by a Dash DataTable
+                              of the percentile bands if `uncertainty` is set.
     """
     if n_clicks is None or n_clicks == 0:
         return ""
@@ -238,9 +318,41 @@ def compute(n_clicks, weight, material):
         if weight is None or material is None:
             return r"/!\ Please provide an input before launching the search"
         try:
-            return html.Div(
+            results = html.Div(
                 str(utils.compute_dimensions(material, weight)), id="div-computeResults"
             )
+            if not uncertainty:
+                return results
+
+            bands = utils.compute_dimensions_uncertainty(material, weight)
+            # one row per quantity, one column per percentile
+            band_columns = list(bands["volume_m3"])
+            return html.Div(
+                [
+                    results,
+                    dash_table.DataTable(
+                        id="datatable-computeBands",
+                        columns=[{"name": "Quantity", "id": "Quantity"}]
+                        + [{"name": p, "id": p} for p in band_columns],
+                        data=[
+                            {"Quantity": "Volume (m³)", **bands["volume_m3"]},
+                            {"Quantity": "Dimension (m)", **bands["dimension_m"]},
+                        ],
+                        style_cell={"textAlign": "center", "padding": "10px"},
+                        style_header={
+                            "backgroundColor": "#f2f2f2",
+                            "fontWeight": "bold",
+                            "border": "1px solid black",
+                        },
+                        style_data={
+                            "border": "1px solid black",
+                            "whiteSpace": "normal",
+                            "height": "auto",
+                            "fontFamily": "Arial, sans-serif",
+                        },
+                    ),
+                ]
+            )
         except Exception as e:
             return f"Error computing dimensions: {str(e)}"
 
@@ -271,25 +383,155 @@ def context(n_clicks_evil, n_clicks_good):
     return ""
 
 
+############################################# API FUNCTIONS #############################################
+
+
+def apiDimensions(item):
+    """
+    Computes the dimensions of one item of a `/api/v1/dimensions` request.
+
+    Args:
+        item (dict): The item, with a "material" and a "weight" field.
+
+    Returns:
+        tuple: The JSON-serializable result of `utils.compute_dimensions()`, or an error, and the matching HTTP status code.
+    """
+    if not isinstance(item, dict) or "material" not in item or "weight" not in item:
+        return {"error": "Each item must be an object with 'material' and 'weight'."}, 400
+    material, weight = item["material"], item["weight"]
+    if not isinstance(material, str):
+        return {"error": "'material' must be a string."}, 400
+    # strings and booleans are rejected, and so are NaN, infinities and integers too large for a float,
+    # which cannot be written back as valid JSON
+    if not isinstance(weight, (int, float)) or isinstance(weight, bool):
+        return {"error": "'weight' must be a finite number."}, 400
+    try:
+        weight = float(weight)
+    except OverflowError:
+        return {"error": "'weight' must be a finite number."}, 400
+    if not math.isfinite(weight):
+        return {"error": "'weight' must be a finite number."}, 400
+    try:
+        return utils.compute_dimensions(material, weight), 200
+    except Exception as e:
+        return {"error": f"Error computing dimensions: {str(e)}"}, 400
+
+
+def apiParts(item):
+    """
+    Looks up the part of one item of a `/api/v1/parts` request.
+
+    Args:
+        item (dict): The item, with a "reference" field.
+
+    Returns:
+        tuple: The part data returned by the database, or an error, and the matching HTTP status code.
+    """
+    if not isinstance(item, dict) or not item.get("reference"):
+        return {"error": "Each item must be an object with a 'reference'."}, 400
+    response = lookupPart(item["reference"])
+    if isinstance(response, Exception):
+        return {"error": f"An error occurred: {str(response)}"}, 502
+    if not 200 <= response.status_code < 300:
+        return {"error": f"Database returned status code {response.status_code}."}, 502
+    try:
+        return response.json(), 200
+    except Exception as e:
+        return {"error": f"Error processing data: {str(e)}"}, 502
+
+
+def _readNDJSON(stream):
+    # parse lazily so large bodies are never held in memory, invalid lines are passed on as is and rejected per item
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line
+
+
+def _handleItem(handler, item):
+    # an unexpected exception is reported for its item only, so it cannot fail a whole batch or cut a stream short
+    try:
+        return handler(item)
+    except Exception as e:
+        return {"error": f"An error occurred: {str(e)}"}, 500
+
+
+def serveAPI(handler):
+    """
+    Applies `handler` to the body of the current request, which is either a single JSON object, a JSON array of objects (batch)
+    or, with the `application/x-ndjson` content type, one JSON object per line.
+
+    Args:
+        handler (callable): Function taking one item and returning a JSON-serializable result and an HTTP status code.
+
+    Returns:
+        flask.Response: With an `Accept: application/x-ndjson` header, the results streamed one per line.
+                        Otherwise, a JSON array of results for a batch, or the single result with its status code.
+    """
+    if request.mimetype == "application/x-ndjson":
+        batch, items = True, _readNDJSON(request.stream)
+    else:
+        body = request.get_json(silent=True)
+        if body is None:
+            return jsonify({"error": "Request body must be JSON."}), 400
+        batch = isinstance(body, list)
+        items = body if batch else [body]
+
+    accepted = request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"])
+    if accepted == "application/x-ndjson":
+        lines = (json.dumps(_handleItem(handler, item)[0]) + "\n" for item in items)
+        return FlaskResponse(stream_with_context(lines), mimetype="application/x-ndjson")
+
+    if batch:
+        return jsonify([_handleItem(handler, item)[0] for item in items])
+    result, status = _handleItem(handler, items[0])
+    return jsonify(result), status
+
+
 ############################################# REGISTER CALLBACK FUNCTIONS #############################################
 
 
 def register_callbacks(app):
+    # the buttons are disabled while their callback is in flight, so repeated clicks cannot queue identical requests
+    # and an older response cannot overwrite a newer one
     @app.callback(
         Output("placeholder-dbResults", "children"),
         [Input("button-searchDB", "n_clicks")],
         [State("input-reference", "value")],
+        running=[(Output("button-searchDB", "disabled"), True, False)],
     )
     def call(n_clicks, input_value):
-        return searchDB(n_clicks, input_value)
+        with tracing.span("callback.searchDB"):
+            # the database request carries no user credentials, so the result does not depend on the session;
+            # add the user identity to the key as soon as it does
+            if not n_clicks:
+                return searchDB(n_clicks, input_value)
+            return dedupe(("searchDB", input_value), searchDB, n_clicks, input_value)
 
     @app.callback(
         Output("placeholder-algoResults", "children"),
         [Input("button-compute", "n_clicks")],
-        [State("input-weight", "value"), State("dropdown-material", "value")],
+        [
+            State("input-weight", "value"),
+            State("dropdown-material", "value"),
+            State("checkbox-uncertainty", "value"),
+        ],
+        running=[(Output("button-compute", "disabled"), True, False)],
     )
-    def call(n_clicks, weight, material):
-        return compute(n_clicks, weight, material)
+    def call(n_clicks, weight, material, uncertainty):
+        with tracing.span("callback.compute"):
+            if not n_clicks:
+                return compute(n_clicks, weight, material, uncertainty)
+            return dedupe(
+                ("compute", weight, material, uncertainty),
+                compute,
+                n_clicks,
+                weight,
+                material,
+                uncertainty,
+            )
 
     @app.callback(
         Output("placeholder-contextResults", "children"),
@@ -302,7 +544,45 @@ def register_callbacks(app):
         return context(n_clicks_evil, n_clicks_good)
 
 
+def register_api(server):
+    @server.route("/api/v1/dimensions", methods=["POST"])
+    def dimensions():
+        return serveAPI(apiDimensions)
+
+    @server.route("/api/v1/parts", methods=["POST"])
+    def parts():
+        return serveAPI(apiParts)
+
+
+def register_tracing(server):
+    # the root span covers the whole request, so its duration minus the callback spans is the time Dash spends
+    # dispatching the request and serializing the response
+    traced_paths = ("/_dash-update-component", "/api/")
+
+    @server.before_request
+    def start_trace():
+        if request.path.startswith(traced_paths):
+            g.trace = tracing.start_trace(
+                f"{request.method} {request.path}",
+                traceparent=request.headers.get("traceparent"),
+            )
+
+    @server.after_request
+    def record_response(response):
+        root = g.get("trace")
+        if root is not None:
+            root.attributes["status_code"] = response.status_code
+            root.attributes["response_bytes"] = response.content_length
+        return response
+
+    @server.teardown_request
+    def end_trace(exc):
+        tracing.end_trace(g.pop("trace", None), exc)
+
+
 register_callbacks(app)
+register_api(app.server)
+register_tracing(app.server)
 
 ############################################# RUN APP #############################################
 
@@ -0,0 +1,69 @@
+import json
+import time
+
+import app as app_file
+
+
+# Number of parts whose dimensions are requested through each path
+N_ITEMS = 2000
+
+
+def dash_payload(weight):
+    # the request the browser sends to the Dash renderer when the compute button is clicked
+    return {
+        "output": "placeholder-algoResults.children",
+        "outputs": {"id": "placeholder-algoResults", "property": "children"},
+        "inputs": [{"id": "button-compute", "property": "n_clicks", "value": 1}],
+        "changedPropIds": ["button-compute.n_clicks"],
+        "state": [
+            {"id": "input-weight", "property": "value", "value": weight},
+            {"id": "dropdown-material", "property": "value", "value": "steel"},
+            {"id": "checkbox-uncertainty", "property": "value", "value": False},
+        ],
+    }
+
+
+def bench(name, run):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {elapsed * 1000:8.1f} ms  {N_ITEMS / elapsed:10.0f} items/s")
+
+
+def main():
+    client = app_file.app.server.test_client()
+    # distinct weights so the callback dedupe window does not answer from the previous result
+    weights = [1 + i / N_ITEMS for i in range(N_ITEMS)]
+    items = [{"material": "steel", "weight": w} for w in weights]
+
+    def dash_path():
+        for w in weights:
+            assert client.post("/_dash-update-component", json=dash_payload(w)).status_code == 200
+
+    def api_single():
+        for item in items:
+            assert client.post("/api/v1/dimensions", json=item).status_code == 200
+
+    def api_batch():
+        assert len(client.post("/api/v1/dimensions", json=items).get_json()) == N_ITEMS
+
+    def api_ndjson():
+        response = client.post(
+            "/api/v1/dimensions",
+            data="".join(json.dumps(item) + "\n" for item in items),
+            content_type="application/x-ndjson",
+            headers={"Accept": "application/x-ndjson"},
+        )
+        assert len(response.get_data(as_text=True).splitlines()) == N_ITEMS
+
+    # warm up the Flask and Dash request handling before measuring
+    client.post("/_dash-update-component", json=dash_payload(0.5))
+
+    bench("Dash /_dash-update-component", dash_path)
+    bench("API, one request per item", api_single)
+    bench("API, JSON batch", api_batch)
+    bench("API, NDJSON stream", api_ndjson)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 import requests_mock
 import requests
 import app as app_file
+import utils
+import tracing
+import pytest
 import dash_bootstrap_components as dbc
 import dash
 from dash import html
 from dash import dash_table
 from requests.exceptions import HTTPError
+import json
 import time
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -268,6 +272,91 @@ def test_callback_compute():
     ), "Issue concerning: unknown material"
 
 
+def test_function_compute_dimensions_uncertainty():
+    point = utils.compute_dimensions("wood", 4)
+    bands = utils.compute_dimensions_uncertainty("wood", 4, n_samples=100_000, seed=0)
+
+    # the bands are ordered and the median stays close to the point estimate
+    for quantity in ("volume_m3", "dimension_m"):
+        assert (
+            bands[quantity]["p5"] < bands[quantity]["p50"] < bands[quantity]["p95"]
+        ), f"Issue concerning: {quantity} bands not ordered"
+        assert bands[quantity]["p50"] == pytest.approx(
+            point[quantity], rel=0.05
+        ), f"Issue concerning: {quantity} median far from the point estimate"
+
+    # the same seed gives the same bands
+    assert bands == utils.compute_dimensions_uncertainty(
+        "wood", 4, n_samples=100_000, seed=0
+    ), "Issue concerning: seeded sampling not reproducible"
+
+    with pytest.raises(ValueError):
+        utils.compute_dimensions_uncertainty("paper", 4)
+    with pytest.raises(ValueError):
+        utils.compute_dimensions_uncertainty("wood", -4)
+    with pytest.raises(ValueError):
+        utils.compute_dimensions_uncertainty("wood", 4, n_samples=0)
+
+    # the compute callback displays the bands below the point estimate
+    result = serialize_dash_component(app_file.compute(1, 4, "Steel", True))
+    assert result["children"][0] == serialize_dash_component(
+        html.Div("{'volume_m3': 0.00051, 'dimension_m': 0.079872}")
+    ), "Issue concerning: point estimate missing in uncertainty mode"
+    assert [row["Quantity"] for row in result["children"][1]["props"]["data"]] == [
+        "Volume (m³)",
+        "Dimension (m)",
+    ], "Issue concerning: bands not displayed in uncertainty mode"
+
+
+def test_function_dedupe():
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        return html.Div(value * 2)
+
+    window = app_file.DEDUPE_WINDOW_S
+    try:
+        # identical keys within the window are only computed once
+        first = app_file.dedupe(("test-dedupe", 1), work, 1)
+        assert app_file.dedupe(("test-dedupe", 1), work, 1) is first
+        assert calls == [1], "Issue concerning: identical call not deduplicated"
+
+        # a different key is computed
+        assert app_file.dedupe(("test-dedupe", 2), work, 2).children == 4
+        assert calls == [1, 2], "Issue concerning: distinct call deduplicated"
+
+        # error messages are not kept, so a retry is computed again
+        def fail(value):
+            calls.append(value)
+            return "Server error: A problem occurred on the server (Status Code: 503)."
+
+        app_file.dedupe(("test-dedupe", 3), fail, 3)
+        app_file.dedupe(("test-dedupe", 3), fail, 3)
+        assert calls == [1, 2, 3, 3], "Issue concerning: error message deduplicated"
+
+        # a call slower than the window is timestamped when it returns, so it is not stored already expired
+        app_file.DEDUPE_WINDOW_S = 0.05
+
+        def slow(value):
+            time.sleep(0.1)
+            return work(value)
+
+        slow_result = app_file.dedupe(("test-dedupe", 4), slow, 4)
+        assert app_file.dedupe(("test-dedupe", 4), slow, 4) is slow_result
+        assert calls == [1, 2, 3, 3, 4], "Issue concerning: slow result stored expired"
+
+        # once the window has elapsed the call is computed again
+        app_file.DEDUPE_WINDOW_S = 0
+        assert app_file.dedupe(("test-dedupe", 1), work, 1) is not first
+        assert calls == [1, 2, 3, 3, 4, 1], "Issue concerning: expired result reused"
+    finally:
+        app_file.DEDUPE_WINDOW_S = window
+        # the cache is shared by the whole module, leave it as it was found
+        for key in [k for k in app_file._recent_results if k[0] == "test-dedupe"]:
+            del app_file._recent_results[key]
+
+
 def test_callback_context():
     def run_callback():
         context_value.set(
@@ -321,6 +410,245 @@ def test_callback_searchDB():
     ), "searchDB(): missing weight or material or both scenario not handled properly"
 
 
+def test_api_dimensions():
+    client = app_file.app.server.test_client()
+
+    # single item
+    response = client.post("/api/v1/dimensions", json={"material": "steel", "weight": 4})
+    assert response.status_code == 200
+    assert response.get_json() == {"volume_m3": 0.00051, "dimension_m": 0.079872}
+
+    # invalid item
+    response = client.post("/api/v1/dimensions", json={"material": "paper", "weight": 4})
+    assert response.status_code == 400
+    assert response.get_json() == {
+        "error": "Error computing dimensions: Material must be 'steel', 'wood', or 'plastic'."
+    }
+
+    # non-numeric and non-finite weights are rejected
+    for weight in ("4", "nan", True, None):
+        response = client.post("/api/v1/dimensions", json={"material": "steel", "weight": weight})
+        assert response.status_code == 400, f"Issue concerning: weight {weight!r} accepted"
+        assert response.get_json() == {"error": "'weight' must be a finite number."}
+    for weight in ("NaN", "Infinity", "1e400", "1" + "0" * 400):
+        response = client.post(
+            "/api/v1/dimensions",
+            data='{"material": "steel", "weight": %s}' % weight,
+            content_type="application/json",
+        )
+        assert response.status_code == 400, f"Issue concerning: weight {weight} accepted"
+
+    response = client.post("/api/v1/dimensions", json={"material": 5, "weight": 4})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "'material' must be a string."}
+
+    # batch, errors are reported per item
+    response = client.post(
+        "/api/v1/dimensions",
+        json=[{"material": "steel", "weight": 4}, {"material": "steel"}],
+    )
+    assert response.status_code == 200
+    assert response.get_json() == [
+        {"volume_m3": 0.00051, "dimension_m": 0.079872},
+        {"error": "Each item must be an object with 'material' and 'weight'."},
+    ]
+    response = client.post(
+        "/api/v1/dimensions",
+        data='[{"material": "steel", "weight": 4}, {"material": "steel", "weight": 1%s}]' % ("0" * 400),
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+    assert response.get_json()[1] == {"error": "'weight' must be a finite number."}
+
+    # streamed NDJSON in and out
+    response = client.post(
+        "/api/v1/dimensions",
+        data='{"material": "steel", "weight": 4}\nnot json\n',
+        content_type="application/x-ndjson",
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == [
+        {"volume_m3": 0.00051, "dimension_m": 0.079872},
+        {"error": "Each item must be an object with 'material' and 'weight'."},
+    ]
+
+
+def test_api_parts():
+    client = app_file.app.server.test_client()
+
+    response = client.post("/api/v1/parts", json={"reference": "100877275"})
+    assert response.status_code == 200
+    assert response.get_json() == data
+
+    response = client.post("/api/v1/parts", json=[{"reference": "100877275"}, {}])
+    assert response.get_json() == [
+        data,
+        {"error": "Each item must be an object with a 'reference'."},
+    ]
+
+    response = client.post("/api/v1/parts", data="not json")
+    assert response.status_code == 400
+
+
+def test_api_unexpected_error(monkeypatch):
+    client = app_file.app.server.test_client()
+    lookupPart = app_file.lookupPart
+
+    def failing_lookup(ref):
+        if ref == "broken":
+            raise RuntimeError("database driver crashed")
+        return lookupPart(ref)
+
+    monkeypatch.setattr(app_file, "lookupPart", failing_lookup)
+    items = [{"reference": "broken"}, {"reference": "100877275"}]
+    error = {"error": "An error occurred: database driver crashed"}
+
+    # an unexpected exception only fails its own item
+    response = client.post("/api/v1/parts", json=items[0])
+    assert response.status_code == 500
+    assert response.get_json() == error
+
+    response = client.post("/api/v1/parts", json=items)
+    assert response.status_code == 200
+    assert response.get_json() == [error, data]
+
+    # the stream is not cut short
+    response = client.post(
+        "/api/v1/parts",
+        json=items,
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == [
+        error,
+        data,
+    ]
+
+
+def test_tracing():
+    client = app_file.app.server.test_client()
+    payload = {
+        "output": "placeholder-dbResults.children",
+        "outputs": {"id": "placeholder-dbResults", "property": "children"},
+        "inputs": [{"id": "button-searchDB", "property": "n_clicks", "value": 1}],
+        "changedPropIds": ["button-searchDB.n_clicks"],
+        "state": [{"id": "input-reference", "property": "value", "value": "tracing"}],
+    }
+    exporter = tracing.InMemoryExporter()
+    tracing.set_exporter(exporter)
+    sample_rate = tracing.SAMPLE_RATE
+    try:
+        # sampling off: nothing is recorded
+        tracing.SAMPLE_RATE = 0
+        assert client.post("/_dash-update-component", json=payload).status_code == 200
+        assert exporter.spans == [], "Issue concerning: unsampled request traced"
+
+        # sampling on: every stage is recorded under the same trace
+        tracing.SAMPLE_RATE = 1
+        app_file._recent_results.clear()
+        assert client.post("/_dash-update-component", json=payload).status_code == 200
+        spans = {span["name"]: span for span in exporter.spans}
+        assert set(spans) == {
+            "searchDB.upstream",
+            "handleDBresponse",
+            "callback.searchDB",
+            "POST /_dash-update-component",
+        }, "Issue concerning: missing stages"
+        root = spans["POST /_dash-update-component"]
+        assert root["parent_id"] is None
+        assert spans["callback.searchDB"]["parent_id"] == root["span_id"]
+        assert spans["searchDB.upstream"]["parent_id"] == spans["callback.searchDB"]["span_id"]
+        assert {span["trace_id"] for span in exporter.spans} == {root["trace_id"]}
+
+        # an incoming sampled trace does not force tracing unless it is trusted
+        def post_parts(traceparent):
+            exporter.clear()
+            client.post(
+                "/api/v1/parts",
+                json={"reference": "100877275"},
+                headers={"traceparent": traceparent},
+            )
+            return [span for span in exporter.spans if span["name"] == "POST /api/v1/parts"]
+
+        tracing.SAMPLE_RATE = 0
+        traceparent = f"00-{'a' * 32}-{'b' * 16}-03"
+        assert post_parts(traceparent) == [], "Issue concerning: untrusted traceparent forced tracing"
+
+        tracing.TRUST_INCOMING_SAMPLED = True
+        root = post_parts(traceparent)[0]
+        assert root["trace_id"] == "a" * 32 and root["parent_id"] == "b" * 16
+
+        # invalid headers are ignored
+        for invalid in (
+            f"00-{'g' * 32}-{'b' * 16}-01",
+            f"00-{'0' * 32}-{'b' * 16}-01",
+            f"00-{'a' * 32}-{'0' * 16}-01",
+            f"00-{'a' * 32}-{'b' * 15}-01",
+            f"ff-{'a' * 32}-{'b' * 16}-01",
+            f"00-{'a' * 32}-{'b' * 16}-00",
+        ):
+            assert post_parts(invalid) == [], f"Issue concerning: {invalid} continued"
+    finally:
+        tracing.SAMPLE_RATE = sample_rate
+        tracing.TRUST_INCOMING_SAMPLED = False
+        tracing.set_exporter(None)
+
+    # an unsampled span has the same interface, and discards what is written to it
+    with tracing.span("unsampled") as span:
+        span.attributes["key"] = "value"
+        assert span.attributes == {} and span.traceparent() is None
+
+    # the trace id is propagated to outgoing requests
+    with tracing.Span("root", "c" * 32) as root:
+        assert tracing.inject({}) == {"traceparent": root.traceparent()}
+    assert tracing.inject({}) == {}, "Issue concerning: header injected outside a trace"
+
+
+def test_tracing_jsonl_exporter(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    exporter = tracing.JsonlFileExporter(str(path))
+    tracing.set_exporter(exporter)
+    try:
+        with tracing.Span("root", "c" * 32):
+            with tracing.span("child") as child:
+                child.attributes["key"] = "value"
+    finally:
+        tracing.set_exporter(None)
+        exporter.close()
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [span["name"] for span in spans] == ["child", "root"]
+    assert spans[0]["attributes"] == {"key": "value"}
+
+
+def test_tracing_export_failure(tmp_path):
+    class FailingExporter:
+        def export(self, record):
+            raise OSError("No space left on device")
+
+    exporter = tracing.JsonlFileExporter(str(tmp_path / "traces.jsonl"))
+    sample_rate = tracing.SAMPLE_RATE
+    tracing.SAMPLE_RATE = 1
+    try:
+        # a failing exporter does not fail the request
+        tracing.set_exporter(FailingExporter())
+        response = app_file.app.server.test_client().post(
+            "/api/v1/parts", json={"reference": "100877275"}
+        )
+        assert response.status_code == 200 and response.get_json() == data
+
+        # a span that cannot be serialized is dropped
+        tracing.set_exporter(exporter)
+        with tracing.Span("root", "c" * 32) as root:
+            root.attributes["unserializable"] = object()
+        exporter.flush()
+        assert (tmp_path / "traces.jsonl").read_text() == ""
+    finally:
+        tracing.SAMPLE_RATE = sample_rate
+        tracing.set_exporter(None)
+        exporter.close()
+
+
 # END-TO-END TEST : simulates a user's interactions (clicks, keys, ...) through the application
 
 
@@ -0,0 +1,239 @@
+import atexit
+import contextvars
+import json
+import random
+import re
+import threading
+import time
+
+
+# Fraction of the requests that are traced, between 0 (off) and 1 (all requests)
+SAMPLE_RATE = 0.0
+# Whether an incoming `traceparent` header flagged as sampled forces the request to be traced, whatever `SAMPLE_RATE`.
+# Only enable it behind a trusted proxy, otherwise any caller can force writes to the exporter on every request
+TRUST_INCOMING_SAMPLED = False
+
+# W3C trace context header: version-trace_id-parent_id-flags, in lowercase hex
+_TRACEPARENT = re.compile(r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})")
+
+# The span currently open in this request, None when the request is not sampled
+_current_span = contextvars.ContextVar("current_span", default=None)
+_exporter = None
+
+
+############################################# EXPORTERS #############################################
+
+
+class InMemoryExporter:
+    """
+    Keeps the finished spans in a list, for tests.
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, record):
+        self.spans.append(record)
+
+    def clear(self):
+        self.spans = []
+
+
+class JsonlFileExporter:
+    """
+    Appends the finished spans to a file, one JSON object per line. The file stays open and is written through
+    a buffer of about 8 KB, which is only flushed when it is full and when the exporter is closed (at the latest,
+    at exit): a recent span does not show in the file right away, call `flush()` to see it.
+
+    Args:
+        path (str): Path of the JSONL file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+        atexit.register(self.close)
+
+    def export(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def set_exporter(exporter):
+    """
+    Sets where the finished spans are sent. Any object with an `export(record)` method can be used.
+
+    Args:
+        exporter (object): The exporter, or None to stop tracing.
+    """
+    global _exporter
+    _exporter = exporter
+
+
+############################################# SPANS #############################################
+
+
+class Span:
+    """
+    A timed stage of a request. Used as a context manager, it is the current span until it exits,
+    so spans opened inside it become its children.
+
+    Args:
+        name (str): Name of the stage.
+        trace_id (str): Identifier shared by all the spans of a request, 32 hex characters.
+        parent_id (str, optional): Identifier of the parent span, None for the root span.
+        **attributes: Additional information recorded with the span.
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, **attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self._token = None
+
+    def __enter__(self):
+        self.start = time.time()
+        self._perf_start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self._perf_start) * 1000
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.attributes["error"] = repr(exc)
+        if _exporter is not None:
+            # tracing must never break the request: a span that cannot be exported (full disk, attribute that
+            # cannot be serialized, ...) is dropped
+            try:
+                _exporter.export(
+                    {
+                        "trace_id": self.trace_id,
+                        "span_id": self.span_id,
+                        "parent_id": self.parent_id,
+                        "name": self.name,
+                        "start": self.start,
+                        "duration_ms": round(duration_ms, 3),
+                        "attributes": self.attributes,
+                    }
+                )
+            except Exception:
+                pass
+        return False
+
+    def traceparent(self):
+        # W3C trace context header, the last field flags the trace as sampled
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+class _NoopSpan:
+    # returned when the request is not sampled, so an unsampled span costs a context variable lookup;
+    # it has the interface of Span, but what is written to it is discarded
+    @property
+    def attributes(self):
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def traceparent(self):
+        return None
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def start_trace(name, traceparent=None, **attributes):
+    """
+    Opens the root span of a request if it is sampled.
+
+    Args:
+        name (str): Name of the root span.
+        traceparent (str, optional): The incoming `traceparent` header. A valid header gives its trace id to the request,
+                                     and a sampled one forces tracing if `TRUST_INCOMING_SAMPLED` is set.
+        **attributes: Additional information recorded with the span.
+
+    Returns:
+        Span or None: The root span, already entered, or None if the request is not sampled.
+    """
+    if _exporter is None:
+        return None
+
+    trace_id, parent_id, sampled = None, None, False
+    match = _TRACEPARENT.fullmatch(traceparent) if traceparent else None
+    # version ff and all-zero ids are invalid, such a header is ignored
+    if match and match[1] != "ff" and int(match[2], 16) and int(match[3], 16):
+        trace_id, parent_id = match[2], match[3]
+        sampled = bool(int(match[4], 16) & 1)
+
+    if not (sampled and TRUST_INCOMING_SAMPLED):
+        if SAMPLE_RATE <= 0 or random.random() >= SAMPLE_RATE:
+            return None
+    if trace_id is None:
+        trace_id = f"{random.getrandbits(128):032x}"
+
+    root = Span(name, trace_id, parent_id, **attributes)
+    return root.__enter__()
+
+
+def end_trace(root, exc=None):
+    """
+    Closes the root span returned by `start_trace()` and exports it.
+
+    Args:
+        root (Span or None): The root span, nothing is done if None.
+        exc (Exception, optional): The exception that ended the request, if any.
+    """
+    if root is not None:
+        root.__exit__(type(exc) if exc else None, exc, None)
+
+
+def span(name, **attributes):
+    """
+    Opens a child span of the current span.
+
+    Args:
+        name (str): Name of the stage.
+        **attributes: Additional information recorded with the span.
+
+    Returns:
+        Span or _NoopSpan: A context manager timing the stage. If the request is not sampled, it does nothing
+                           and its attributes are discarded.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, **attributes)
+
+
+def inject(headers):
+    """
+    Adds the `traceparent` header of the current span to the headers of an outgoing request.
+
+    Args:
+        headers (dict): The headers of the outgoing request, modified in place.
+
+    Returns:
+        dict: The same headers.
+    """
+    current = _current_span.get()
+    if current is not None:
+        headers["traceparent"] = current.traceparent()
+    return headers
@@ -1,5 +1,42 @@
 
 
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# Densities in kg/m³
+MATERIAL_DENSITIES = {
+    "steel": 7850,   # Density of steel
+    "wood": 600,     # Density of wood (approximate, varies by type)
+    "plastic": 950   # Density of plastic (approximate)
+}
+
+# Standard deviation of the density in kg/m³, used by the uncertainty mode
+MATERIAL_DENSITY_SPREADS = {
+    "steel": 60,     # Carbon and low-alloy steels stay within a narrow range
+    "wood": 150,     # Balsa to oak, depends heavily on species and moisture
+    "plastic": 120   # Polyethylene to PVC
+}
+
+# Batches above this size are spread across a process pool, smaller ones are faster in-process
+PARALLEL_THRESHOLD = 4_000_000
+# Number of samples drawn at once; sampling one chunk needs three temporary arrays (~24 MB)
+CHUNK_SIZE = 1_000_000
+# Maximum number of samples per estimation. The volumes are gathered in one preallocated array of 8 bytes per sample
+# and the percentiles are computed in place, so the peak memory is about 8 B x MAX_SAMPLES (160 MB) plus the chunks
+# being sampled: one in-process, or up to 2 x workers in pool mode, each received once pickled (~16 MB per chunk)
+MAX_SAMPLES = 20_000_000
+
+# Process pool shared by all the large estimations, created on first use
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
 def compute_dimensions(material: str, weight: float) -> dict:
     """
     Computes the estimated dimensions of a piece based on its material and weight.
@@ -15,21 +52,14 @@ def compute_dimensions(material: str, weight: float) -> dict:
         ValueError: If the material is not recognized or the weight is non-positive.
     """
 
-    # Densities in kg/m³
-    material_densities = {
-        "steel": 7850,   # Density of steel
-        "wood": 600,     # Density of wood (approximate, varies by type)
-        "plastic": 950   # Density of plastic (approximate)
-    }
-
     # Validate material and weight
-    if material.lower() not in material_densities:
+    if material.lower() not in MATERIAL_DENSITIES:
         raise ValueError("Material must be 'steel', 'wood', or 'plastic'.")
     if weight <= 0:
         raise ValueError("Weight must be a positive number.")
 
     # Get the density for the given material
-    density = material_densities[material.lower()]
+    density = MATERIAL_DENSITIES[material.lower()]
 
     # Calculate volume (in cubic meters)
     volume = weight / density
@@ -40,4 +70,131 @@ def compute_dimensions(material: str, weight: float) -> dict:
     return {
         "volume_m3": round(volume, 6),  # Volume in cubic meters, rounded for readability
         "dimension_m": round(dimension, 6)  # Dimension (one side of a cube) in meters, rounded
-    }
\ No newline at end of file
+    }
+
+
+def _lognormal_params(mean: float, std: float) -> tuple:
+    """
+    Converts the mean and standard deviation of a lognormal distribution into the parameters of the underlying normal.
+
+    Args:
+        mean (float): Mean of the lognormal distribution, strictly positive.
+        std (float): Standard deviation of the lognormal distribution.
+
+    Returns:
+        tuple: The mean and standard deviation of the underlying normal distribution.
+    """
+    sigma2 = np.log1p((std / mean) ** 2)
+    return np.log(mean) - sigma2 / 2, np.sqrt(sigma2)
+
+
+def _sample_volumes(density_params: tuple, weight_params: tuple, size: int, seed) -> np.ndarray:
+    """
+    Draws `size` volume samples from lognormal density and weight distributions.
+
+    Args:
+        density_params (tuple): Parameters of the density distribution, as returned by `_lognormal_params()`.
+        weight_params (tuple): Parameters of the weight distribution, as returned by `_lognormal_params()`.
+        size (int): Number of samples to draw.
+        seed: Seed or `np.random.SeedSequence` of the random generator.
+
+    Returns:
+        np.ndarray: The sampled volumes in cubic meters.
+    """
+    rng = np.random.default_rng(seed)
+    volumes = rng.lognormal(*weight_params, size)
+    volumes /= rng.lognormal(*density_params, size)
+    return volumes
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    # The workers are spawned rather than forked: forking the multi-threaded Flask server process can deadlock
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def compute_dimensions_uncertainty(
+    material: str,
+    weight: float,
+    weight_tolerance: float = 0.05,
+    n_samples: int = 1_000_000,
+    percentiles: tuple = (5, 50, 95),
+    seed=None,
+) -> dict:
+    """
+    Estimates percentile bands of the volume and dimension of a piece by Monte Carlo sampling of its density and weight.
+
+    Density and weight are drawn from lognormal distributions with the mean and spread of the material (see
+    `MATERIAL_DENSITY_SPREADS`) and of the weight. Unlike a clipped normal, they stay strictly positive without
+    piling up absurdly light densities in the tail, which would blow up the upper volume bands.
+
+    Samples are drawn by chunks of `CHUNK_SIZE`, each with its own random stream, so a given seed gives the same
+    result in-process and in the process pool. The pool is meant for large offline batches; the UI stays below
+    `PARALLEL_THRESHOLD`.
+
+    Args:
+        material (str): The material of the piece. Must be "steel", "wood", or "plastic".
+        weight (float): The weight of the piece in kilograms.
+        weight_tolerance (float): Relative standard deviation of the weight (0.05 means ±5%).
+        n_samples (int): Number of samples to draw. Above `PARALLEL_THRESHOLD`, sampling is spread across a process pool.
+        percentiles (tuple): The percentiles to report, between 0 and 100.
+        seed (int, optional): Seed of the random generator, for reproducible results.
+
+    Returns:
+        dict: A dictionary containing, for the volume (in cubic meters) and the dimension (in meters),
+              a dictionary mapping each percentile ("p5", "p50", ...) to its value.
+
+    Raises:
+        ValueError: If the material is not recognized, the weight is non-positive, the tolerance is negative
+                    or the number of samples is not between 1 and `MAX_SAMPLES`.
+    """
+
+    # Validate inputs
+    if material.lower() not in MATERIAL_DENSITIES:
+        raise ValueError("Material must be 'steel', 'wood', or 'plastic'.")
+    if weight <= 0:
+        raise ValueError("Weight must be a positive number.")
+    if weight_tolerance < 0:
+        raise ValueError("Weight tolerance must not be negative.")
+    if not 1 <= n_samples <= MAX_SAMPLES:
+        raise ValueError(f"Number of samples must be between 1 and {MAX_SAMPLES}.")
+
+    density_params = _lognormal_params(MATERIAL_DENSITIES[material.lower()], MATERIAL_DENSITY_SPREADS[material.lower()])
+    weight_params = _lognormal_params(weight, weight * weight_tolerance)
+
+    starts = range(0, n_samples, CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    volumes = np.empty(n_samples)
+    workers = os.cpu_count() or 1
+
+    if n_samples <= PARALLEL_THRESHOLD or workers == 1:
+        for start, chunk_seed in zip(starts, seeds):
+            stop = min(start + CHUNK_SIZE, n_samples)
+            volumes[start:stop] = _sample_volumes(density_params, weight_params, stop - start, chunk_seed)
+    else:
+        # Keep at most 2 chunks per worker in flight, and copy each one into place as soon as it arrives
+        pool = _get_pool(workers)
+        pending = []
+        for start, chunk_seed in zip(starts, seeds):
+            stop = min(start + CHUNK_SIZE, n_samples)
+            pending.append((start, stop, pool.submit(_sample_volumes, density_params, weight_params, stop - start, chunk_seed)))
+            if len(pending) >= 2 * workers:
+                done_start, done_stop, future = pending.pop(0)
+                volumes[done_start:done_stop] = future.result()
+        for done_start, done_stop, future in pending:
+            volumes[done_start:done_stop] = future.result()
+
+    # The cube root is monotonic, so the dimension percentiles follow directly from the volume percentiles
+    volume_bands = np.percentile(volumes, percentiles, overwrite_input=True)
+    dimension_bands = np.cbrt(volume_bands)
+
+    return {
+        "volume_m3": {f"p{p}": round(float(v), 6) for p, v in zip(percentiles, volume_bands)},
+        "dimension_m": {f"p{p}": round(float(d), 6) for p, d in zip(percentiles, dimension_bands)},
+    }